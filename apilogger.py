@@ -1,31 +1,68 @@
 import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
+# How often the writer thread pushes the log all the way to disk.
+# flush() after each batch protects against process crashes; the
+# periodic fsync bounds what an OS crash or power loss can take.
+_FSYNC_INTERVAL_SECONDS = 30.0
+
+# orjson serializes log entries several times faster than the stdlib
+# encoder; fall back to json if it isn't installed
+try:
+    import orjson    # type: ignore[import]
+    def _dump_line(entry) -> bytes:
+        return orjson.dumps(entry) + b'\n'
+except ImportError:
+    def _dump_line(entry) -> bytes:
+        return (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+
 class ApiLogger:
-    def __init__(self, base_dir="api_logs"):
+    def __init__(self, base_dir="api_logs", name_suffix=""):
         """
         Initialize the API logger.
-        This creates one file for each monitoring session.
+        This creates one file for each monitoring session; name_suffix
+        (e.g. the stop id) keeps concurrent sessions started in the
+        same second from sharing a file.
+
+        Writes happen on a daemon writer thread fed by a bounded queue,
+        so the monitoring loop never blocks on disk. If the queue ever
+        fills (disk stalled for minutes) entries are dropped and counted
+        rather than stalling the poll.
         """
         self.base_dir = base_dir
         self._setup_directory()
-        self.filename = f"api_responses_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+        suffix = f"_{name_suffix}" if name_suffix else ""
+        self.filename = f"api_responses_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}{suffix}.jsonl"
         self.filepath = os.path.join(self.base_dir, self.filename)
         self._initialize_file()
+        self.dropped = 0
+        self._last_fsync = time.monotonic()
+        self._queue = queue.Queue(maxsize=1024)
+        self._writer = threading.Thread(target=self._drain, daemon=True)
+        self._writer.start()
 
     def _setup_directory(self):
         """Create the log directory if it doesn't exist."""
         os.makedirs(self.base_dir, exist_ok=True)
 
     def _initialize_file(self):
-        """Initialize the JSON file with an empty list."""
-        with open(self.filepath, 'w') as f:
-            json.dump([], f)
+        """Open the session's JSON Lines file and keep the handle.
+
+        Opening once and reusing the handle avoids an open/close
+        syscall pair on every poll.
+        """
+        self._file = open(self.filepath, 'ab', buffering=1<<16)
 
     def log_response(self, response_data, stop_id=None):
         """
-        Append API response to the session's JSON file.
+        Queue an API response for the writer thread.
+
+        Each entry becomes one line in the session's JSON Lines file,
+        so we never re-read or rewrite the existing history.
         """
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -33,13 +70,46 @@ class ApiLogger:
             "response": response_data
         }
 
-        # Read existing data
-        with open(self.filepath, 'r') as f:
-            data = json.load(f)
+        try:
+            self._queue.put_nowait(log_entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Flush anything still queued and close the session file.
+
+        Safe to call once at shutdown; log_response must not be called
+        afterwards.
+        """
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+    def _drain(self):
+        """Writer thread: drain queued entries and write them in batches."""
+        while True:
+            # Block for the first entry, then grab whatever else is
+            # already queued so one flush covers the whole batch
+            entries = [self._queue.get()]
+            while len(entries) < 64:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # None is the shutdown sentinel from close()
+            closing = entries[-1] is None
+            if closing:
+                entries.pop()
+
+            # One write call for the whole batch instead of one per entry
+            self._file.write(b''.join(_dump_line(entry) for entry in entries))
+            self._file.flush()
 
-        # Append new entry
-        data.append(log_entry)
+            now = time.monotonic()
+            if closing or now - self._last_fsync >= _FSYNC_INTERVAL_SECONDS:
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
 
-        # Write back to file
-        with open(self.filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+            if closing:
+                self._file.close()
+                return
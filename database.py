@@ -1,12 +1,73 @@
+import logging
+import queue
 import sqlite3
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, List, Optional
+
+# One connection for the whole session. Opening a fresh connection per
+# insert costs file opens and an fsync every time; reusing one (with WAL
+# on) makes each save a cheap append to the write-ahead log.
+_conn: Optional[sqlite3.Connection] = None
+
+# Serializes access to the shared connection when several monitor
+# threads (one per stop) save at the same time
+_lock = threading.Lock()
+
+# Batches queued by the monitor threads for the background writer, so a
+# slow disk never delays the next poll. Items are row-batch lists, or
+# threading.Events used by flush_database to wait for drain.
+_write_queue: queue.SimpleQueue = queue.SimpleQueue()
+_writer: Optional[threading.Thread] = None
+
+# PRAGMAs applied once when the connection is opened.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=30000",
+)
+
+# Upsert so a trip_id that re-appears (next-day recycled IDs, buses that
+# came back after the 300s disappearance window) updates its arrival
+# details instead of raising and aborting the whole transaction
+#
+# The statement is a module constant bound by name: with the persistent
+# connection, sqlite3's statement cache keeps the compiled form resident,
+# and callers pass a column-name mapping instead of a 14-tuple in order
+_INSERT_SQL = '''
+    INSERT INTO bus_data VALUES (
+        :trip_id, :route, :headsign, :direction,
+        :first_seen_at, :initial_due_in_seconds,
+        :arrival_time, :actual_duration_seconds,
+        :prediction_difference_seconds, :prediction_difference_minutes,
+        :day_of_week, :is_weekend, :time_of_day, :peak_hours)
+    ON CONFLICT(trip_id) DO UPDATE SET
+        arrival_time=excluded.arrival_time,
+        actual_duration_seconds=excluded.actual_duration_seconds,
+        prediction_difference_seconds=excluded.prediction_difference_seconds,
+        prediction_difference_minutes=excluded.prediction_difference_minutes
+'''
+
+# Returns the shared connection, opening and tuning it on first use
+def _get_conn(db_name: str = "bus_monitoring.db") -> sqlite3.Connection:
+    """Return the shared SQLite connection, creating it on first use."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(db_name, isolation_level=None, check_same_thread=False)
+        for pragma in _PRAGMAS:
+            _conn.execute(pragma)
+    return _conn
 
 # Sets up SQLite database
 def setup_database(db_name: str = "bus_monitoring.db"):
     """Set up the SQLite database and table."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute('''
+    with _lock:
+        _setup_database_locked(db_name)
+
+def _setup_database_locked(db_name: str):
+    conn = _get_conn(db_name)
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS bus_data (
             trip_id TEXT PRIMARY KEY,
             route TEXT,
@@ -24,31 +85,107 @@ def setup_database(db_name: str = "bus_monitoring.db"):
             peak_hours INTEGER
         )
     ''')
-    conn.commit()
-    conn.close()
+    # Indexes for the analytics queries we actually run ("average
+    # lateness for route X on weekday mornings", date-range scans);
+    # without them every query walks the whole table
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_route_dow_tod
+        ON bus_data(route, day_of_week, time_of_day)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_first_seen
+        ON bus_data(first_seen_at)
+    ''')
 
 # Saves data from the bus_data object to the SQLite database
 def save_to_database(bus_data: Dict[str, Any], db_name: str = "bus_monitoring.db"):
     """Save bus data to the SQLite database."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO bus_data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        bus_data['trip_id'],
-        bus_data['route'],
-        bus_data['headsign'],
-        bus_data['direction'],
-        bus_data['first_seen_at'].strftime('%Y-%m-%d %H:%M:%S'),
-        bus_data['initial_due_in_seconds'],
-        bus_data['last_seen_at'].strftime('%Y-%m-%d %H:%M:%S'),
-        bus_data['actual_duration_seconds'],
-        bus_data['prediction_difference_seconds'],
-        bus_data['prediction_difference_minutes'],
-        bus_data['day_of_week'],
-        bus_data['is_weekend'],
-        bus_data['time_of_day'],
-        bus_data['peak_hours']
-    ))
-    conn.commit()
-    conn.close()
+    with _lock:
+        conn = _get_conn(db_name)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(_INSERT_SQL, {
+                'trip_id': bus_data['trip_id'],
+                'route': bus_data['route'],
+                'headsign': bus_data['headsign'],
+                'direction': bus_data['direction'],
+                'first_seen_at': bus_data['first_seen_at'].isoformat(sep=' ', timespec='seconds'),
+                'initial_due_in_seconds': bus_data['initial_due_in_seconds'],
+                'arrival_time': bus_data['last_seen_at'].isoformat(sep=' ', timespec='seconds'),
+                'actual_duration_seconds': bus_data['actual_duration_seconds'],
+                'prediction_difference_seconds': bus_data['prediction_difference_seconds'],
+                'prediction_difference_minutes': bus_data['prediction_difference_minutes'],
+                'day_of_week': bus_data['day_of_week'],
+                'is_weekend': bus_data['is_weekend'],
+                'time_of_day': bus_data['time_of_day'],
+                'peak_hours': bus_data['peak_hours']
+            })
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+# Queues a poll cycle's worth of completed buses for the writer thread
+def save_batch_to_database(rows: List[Dict[str, Any]], db_name: str = "bus_monitoring.db"):
+    """Queue a batch of bus rows (column-name mappings) for writing.
+
+    The actual insert happens on a daemon writer thread, so the polling
+    loop never waits on the disk; batches that pile up behind a slow
+    write are coalesced into a single transaction. Call flush_database
+    before shutdown to make sure everything queued has landed.
+    """
+    if not rows:
+        return
+    _ensure_writer(db_name)
+    _write_queue.put(rows)
+
+# Blocks until everything queued so far has been written
+def flush_database(timeout: float = 5.0):
+    """Wait for the writer thread to drain the queue (used at shutdown)."""
+    if _writer is None:
+        return
+    done = threading.Event()
+    _write_queue.put(done)
+    done.wait(timeout)
+
+# Starts the background writer on first save
+def _ensure_writer(db_name: str):
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, args=(db_name,), daemon=True)
+            _writer.start()
+
+# Writer thread: drain queued batches and write them in one transaction each
+def _writer_loop(db_name: str):
+    while True:
+        # Block for the first item, then coalesce whatever else is queued
+        items = [_write_queue.get()]
+        while True:
+            try:
+                items.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        rows = [row for item in items if isinstance(item, list) for row in item]
+        if rows:
+            try:
+                _write_rows(rows, db_name)
+            except Exception as e:
+                logging.error("Error writing bus data: %s", e)
+
+        # Release anyone waiting in flush_database
+        for item in items:
+            if isinstance(item, threading.Event):
+                item.set()
+
+def _write_rows(rows: List[Dict[str, Any]], db_name: str):
+    with _lock:
+        conn = _get_conn(db_name)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(_INSERT_SQL, rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
@@ -100,6 +100,14 @@ class TransitHandler:
     stops = req.params.get('stop', self._stops)
     data = self._transit.GetLive(stops)
 
+    # Optional route filter (?route=41&route=41A): filtering here keeps
+    # pollers that only care about a few routes from downloading and
+    # parsing everything else at the stop.
+    routes = req.params.get('route')
+    if routes:
+      wanted = frozenset(routes)
+      data = [d for d in data if d.route in wanted]
+
     req.SendHeaders(200, 'application/json')
     req.Send(json.dumps({
       'current_timestamp': int(datetime.datetime.now().timestamp()),
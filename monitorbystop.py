@@ -1,31 +1,99 @@
-import csv
 import datetime
+import http.client
+import logging
+import random
+import threading
 import time
 import json
-import urllib.request
-import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Union
 from apilogger import ApiLogger
-from database import setup_database, save_to_database
+from database import setup_database, save_batch_to_database, flush_database
+
+# orjson parses the live feed several times faster than the stdlib
+# decoder; fall back to json if it isn't installed
+try:
+    import orjson    # type: ignore[import]
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+    _HAVE_ORJSON = True
+except ImportError:
+    _loads = json.loads
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    _HAVE_ORJSON = False
+
+# One keep-alive connection per monitor thread, reused across polls so
+# we don't pay a TCP handshake every poll (http.client connections
+# aren't safe to share between threads)
+_local = threading.local()
+
+# Returns this thread's connection, opening it on first use
+def _get_connection() -> http.client.HTTPConnection:
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = http.client.HTTPConnection("127.0.0.1", 6824, timeout=10)
+        _local.conn = conn
+    return conn
+
+# Drops this thread's connection so the next poll reconnects from scratch
+def _reset_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
 # Tries to get bus data from the API
 # If successful, returns the data and logs it
 # If it fails we simply return None
-def get_live_data(stop_id: str, logger=None):
+def get_live_data(stop_id: Union[str, List[str]], logger=None, routes=None):
     """
-    Fetches real-time bus data from the local GTFS server for a specific stop.
+    Fetches real-time bus data from the local GTFS server.
+
+    stop_id can be a single stop or a list of stops. The server accepts
+    repeated stop= parameters and merges the results into one 'live'
+    list, so polling several stops still costs a single round trip on
+    the keep-alive connection. If routes is given, they're passed as
+    route= parameters so the server filters before sending anything,
+    shrinking both the wire bytes and our parse work.
     """
-    url = f"http://127.0.0.1:6824/live.json?stop={stop_id}"
+    stops = [stop_id] if isinstance(stop_id, str) else stop_id
+    path = "/live.json?" + "&".join(f"stop={s}" for s in stops)
+    if routes:
+        path += "".join(f"&route={r}" for r in routes)
 
     try:
-        response = urllib.request.urlopen(url)
-        data = json.loads(response.read())
+        conn = _get_connection()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+        except (http.client.BadStatusLine, http.client.RemoteDisconnected, ConnectionResetError):
+            # The server closed the idle keep-alive socket between polls;
+            # reconnect and retry once rather than losing this cycle
+            _reset_connection()
+            conn = _get_connection()
+            conn.request("GET", path)
+            response = conn.getresponse()
+        if _HAVE_ORJSON:
+            data = _loads(response.read())
+        else:
+            # Stream straight off the socket: json.load consumes the
+            # response without first materializing the whole body as a
+            # separate bytes object (orjson has no streaming API, so it
+            # keeps the single read() above)
+            data = json.load(response)
         if logger:
             logger.log_response(data, stop_id)
         return data
 
-    except Exception as e:
-        print(f"Error fetching data: {e}")
+    # OSError covers timeouts/refused connections, HTTPException covers
+    # protocol breakage, ValueError covers a JSON body that won't parse
+    # (json and orjson decode errors both subclass it). Anything else is
+    # a bug and should surface, not be swallowed.
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        logging.warning("Error fetching data: %s", e)
+        # The socket may be in a bad state (stale keep-alive, reset, etc.)
+        # so start fresh next time
+        _reset_connection()
         return None
 
 # Figures out if it's morning/afternoon/evening/night based on the hour
@@ -46,107 +114,358 @@ def is_peak_hour(hour: int, day_of_week: int) -> bool:
     is_weekday = day_of_week < 5
     return (is_morning_peak or is_evening_peak) and is_weekday
 
+_WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# Precomputed table of (day_name, is_weekend, time_of_day, peak_hours) for
+# every (weekday, hour) combination, so completed buses do one lookup
+# instead of re-deriving all four values per insert
+_CALENDAR = tuple(
+    tuple((_WEEKDAYS[d],
+           d >= 5,
+           get_time_of_day(h),
+           is_peak_hour(h, d))
+          for h in range(24))
+    for d in range(7)
+)
+
+# Bounds for the adaptive poll interval (seconds)
+_MIN_POLL_SECONDS = 5.0
+_MAX_POLL_SECONDS = 20.0
+
+# Picks how long to wait before the next poll based on the live data
+def _poll_interval(data: Dict[str, Any]) -> float:
+    """Choose the next poll delay from the nearest due-in time.
+
+    Polls tighten to every 5s when a bus is about to arrive (the moment
+    that decides the disappeared-means-arrived signal) and relax to 20s
+    when nothing is due soon, saving API calls in quiet periods. The
+    small jitter keeps multiple monitors from polling in lockstep.
+    """
+    nearest = min((bus['dueInSeconds'] for bus in data['live']), default=600.0)
+    interval = max(_MIN_POLL_SECONDS, min(_MAX_POLL_SECONDS, nearest / 10.0))
+    return interval + random.uniform(0, 0.5)
+
+# Compact record for a bus we're currently tracking.
+# __slots__ keeps each bus to a fixed set of fields instead of a per-bus
+# dict with string keys, cutting the per-bus memory by roughly 3x and
+# turning every field access into a fixed-offset load
+class TrackedBus:
+    __slots__ = ('trip_id', 'route', 'headsign', 'direction',
+                 'first_seen_at', 'first_seen_str', 'day_of_week', 'hour',
+                 'first_seen_mono', 'last_seen_mono',
+                 'last_seen_at', 'initial_due_in_seconds',
+                 'last_seen_due_seconds', 'seen_cycle')
+
+    def __init__(self, trip_id: str, bus: Dict[str, Any], first_seen_at,
+                 first_seen_str: str, first_seen_mono: float, seen_cycle: int):
+        self.trip_id = trip_id
+        self.route = bus['route']
+        self.headsign = bus['headsign']
+        self.direction = bus['direction']
+        self.first_seen_at = first_seen_at
+        # Cache the formatted timestamp and calendar indices now, so the
+        # completion path never has to go back to the datetime object
+        self.first_seen_str = first_seen_str
+        self.day_of_week = first_seen_at.weekday()
+        self.hour = first_seen_at.hour
+        # Monotonic timestamps drive the duration math: unlike wall-clock
+        # datetimes they can't jump (NTP sync, DST) mid-journey, and the
+        # delta is a plain float subtraction instead of timedelta objects
+        self.first_seen_mono = first_seen_mono
+        self.last_seen_mono = first_seen_mono
+        self.last_seen_at = first_seen_at
+        self.initial_due_in_seconds = bus['dueInSeconds']
+        self.last_seen_due_seconds = bus['dueInSeconds']
+        self.seen_cycle = seen_cycle
+
+# Builds the database row for a bus that has finished its journey.
+# Keeping this in one place means the row layout and the calendar lookup
+# only ever have to change here
+def _completed_row(bus_data: TrackedBus, actual_duration: float,
+                   prediction_difference: float) -> Dict[str, Any]:
+    day_name, is_weekend, time_of_day, peak_hours = _CALENDAR[bus_data.day_of_week][bus_data.hour]
+    return {
+        'trip_id': bus_data.trip_id,
+        'route': bus_data.route,
+        'headsign': bus_data.headsign,
+        'direction': bus_data.direction,
+        'first_seen_at': bus_data.first_seen_str,
+        'initial_due_in_seconds': bus_data.initial_due_in_seconds,
+        'arrival_time': bus_data.last_seen_at.isoformat(sep=' ', timespec='seconds'),
+        'actual_duration_seconds': actual_duration,
+        'prediction_difference_seconds': prediction_difference,
+        'prediction_difference_minutes': prediction_difference / 60,
+        'day_of_week': day_name,
+        'is_weekend': is_weekend,
+        'time_of_day': time_of_day,
+        'peak_hours': peak_hours
+    }
+
+# One WAL line recording that we started tracking a bus: everything
+# needed to rebuild its TrackedBus entry after a restart
+def _wal_seen_line(bus_data: TrackedBus) -> bytes:
+    return _dumps({
+        'e': 'seen',
+        'trip_id': bus_data.trip_id,
+        'route': bus_data.route,
+        'headsign': bus_data.headsign,
+        'direction': bus_data.direction,
+        'first_seen_at': bus_data.first_seen_str,
+        'initial_due_in_seconds': bus_data.initial_due_in_seconds
+    }) + b'\n'
+
+# Rebuilds in-flight buses from the WAL a previous run left behind
+def _replay_wal(path: str, tracked_buses: Dict[str, TrackedBus]):
+    """Replay the tracking WAL into tracked_buses.
+
+    Each 'seen' line re-creates a TrackedBus; each 'done' line removes
+    one. Whatever is left after replay was in flight when the previous
+    run died, so its arrival can still be recorded instead of lost.
+    """
+    try:
+        with open(path, 'rb') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return
+
+    now_wall = datetime.datetime.now()
+    now_mono = time.monotonic()
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = _loads(line)
+            event = record['e']
+        except (ValueError, KeyError):
+            # A torn final line from a crash mid-append; skip it
+            continue
+
+        if event == 'seen':
+            try:
+                trip_id = record['trip_id']
+                first_seen_str = record['first_seen_at']
+                first_seen_at = datetime.datetime.fromisoformat(first_seen_str)
+                bus = {'route': record['route'],
+                       'headsign': record['headsign'],
+                       'direction': record['direction'],
+                       'dueInSeconds': record['initial_due_in_seconds']}
+            except (KeyError, ValueError):
+                continue
+            # The old process's monotonic readings mean nothing here, so
+            # back-date this run's clock by the bus's wall-clock age to
+            # keep actual_duration right. last_seen is reset to now: if
+            # the bus arrived while we were down its recorded arrival is
+            # late by at most the downtime, but buses still en route pick
+            # up tracking exactly where it left off
+            age = (now_wall - first_seen_at).total_seconds()
+            restored = TrackedBus(trip_id, bus, first_seen_at, first_seen_str,
+                                  now_mono - age, 0)
+            restored.last_seen_at = now_wall
+            restored.last_seen_mono = now_mono
+            tracked_buses[trip_id] = restored
+        elif event == 'done':
+            tracked_buses.pop(record.get('trip_id'), None)
+
+# Opens the WAL for appending, compacted down to just the in-flight buses
+def _open_wal(path: str, tracked_buses: Dict[str, TrackedBus]):
+    """Rewrite the WAL with one 'seen' line per surviving bus.
+
+    Compacting on startup keeps the file a handful of lines instead of
+    growing forever. Unbuffered so every append hits the file before
+    the next poll (the lines are tiny; this is one write syscall each).
+    """
+    wal = open(path, 'wb', buffering=0)
+    for bus_data in tracked_buses.values():
+        wal.write(_wal_seen_line(bus_data))
+    return wal
+
 # Main monitoring function that tracks all buses at a specific stop.
-def monitor_bus(stop_id: str):
+# routes, if given, is a frozenset of route numbers to watch; anything
+# else at the stop is ignored. One frozenset probe per bus scales from
+# one route to dozens with no code change, and None means track them all
+def monitor_bus(stop_id: str, routes: Optional[frozenset] = None):
 
     # Set up SQLite database
     setup_database()
 
-    # Logging Data to JSON file
-    logger = ApiLogger()
-    print(f"Logging API responses to {logger.filepath}")
+    # Logging Data to JSON file (named after the stop so concurrent
+    # monitors don't write to the same session file)
+    logger = ApiLogger(name_suffix=stop_id)
+    logging.info("Logging API responses to %s", logger.filepath)
+
+    # Buses we're currently tracking, keyed by trip_id
+    tracked_buses: Dict[str, TrackedBus] = {}
 
-    # Create dictionary with key:value types of string:dict
-    tracked_buses: Dict[str, Dict[str, Any]] = {}
+    # Crash recovery: replay the tracking WAL from any previous run so
+    # in-flight journeys survive a restart, then reopen it compacted
+    wal_path = f"tracked_buses_{stop_id}.wal"
+    _replay_wal(wal_path, tracked_buses)
+    if tracked_buses:
+        logging.info("Restored %d in-flight buses from %s", len(tracked_buses), wal_path)
+    wal = _open_wal(wal_path, tracked_buses)
+
+    # Poll cycle counter used to mark which buses were seen this cycle
+    cycle_id = 0
 
     # Print to terminal (for testing)
-    print(f"Starting monitoring of all buses at stop {stop_id}")
-    print(f"Writing data to database")
-    print(f"Will start tracking buses when they are 10 minutes or less from arrival")
+    logging.info("Starting monitoring of all buses at stop %s", stop_id)
+    logging.info("Writing data to sqlite: bus_monitoring.db")
+    logging.info("Will start tracking buses when they are 10 minutes or less from arrival")
 
-    while True:
-        try:
-            # Get current time
-            current_time = datetime.datetime.now()
-
-            # Call get live data and pass the stop to get the data and assign it to 'data' for alongside the logger
-            data = get_live_data(stop_id, logger=logger)
-
-            # Create empty set
-            current_trip_ids = set()
-
-            # Loop through each bus in the API response and add it to our current trips
-            for bus in data['live']:
-                trip_id = bus['trip_id']
-                due_in_minutes = bus['dueInSeconds'] / 60
-                current_trip_ids.add(trip_id)
-
-                # If we're already tracking this bus, update its last seen time
-                if trip_id in tracked_buses:
-                    tracked_buses[trip_id]['last_seen_at'] = current_time
-                    tracked_buses[trip_id]['last_seen_due_seconds'] = bus['dueInSeconds']
-
-                # If it's a new bus and it's due in the next 10 mins, start tracking it
-                if trip_id not in tracked_buses and due_in_minutes <= 10:
-                    tracked_buses[trip_id] = {
-                        'trip_id': trip_id,
-                        'first_seen_at': current_time,
-                        'last_seen_at': current_time,
-                        'initial_due_in_seconds': bus['dueInSeconds'],
-                        'route': bus['route'],
-                        'headsign': bus['headsign'],
-                        'direction': bus['direction'],
-                        'last_seen_due_seconds': bus['dueInSeconds']
-                    }
-
-                    print(f"New bus detected: Route {bus['route']}, Trip {trip_id}, Due in {round(due_in_minutes, 2)} minutes")
-
-            # Find buses that have disappeared from the response by comparing what we're tracking vs what we can see
-            disappeared_buses = set(tracked_buses.keys()) - current_trip_ids
-
-            # For each bus that has disappeared (therefore potentially arrived)
-            for trip_id in disappeared_buses:
-
-                # Check when we last saw this bus
-                bus_last_seen = tracked_buses[trip_id]['last_seen_at']
-
-                # Calculate how many seconds its been since we last saw said bus
-                seconds_since_last_seen = (current_time - bus_last_seen).total_seconds()
-
-                # If statement to only mark bus as arrived if it hasnt been seen in over 300 secs (to prevent busses that temporarily disappeared from tracking being marked as arrived)
-                if seconds_since_last_seen > 300:
-
-                    bus_data = tracked_buses[trip_id]
-
-                    # Calculate derived values
-                    actual_duration = (bus_last_seen - bus_data['first_seen_at']).total_seconds()
-                    prediction_difference = actual_duration - bus_data['initial_due_in_seconds']
-                    day_of_week = bus_data['first_seen_at'].weekday()
-                    hour = bus_data['first_seen_at'].hour
-
-                    # Adding derived values to bus_data object
-                    bus_data['actual_duration_seconds'] = actual_duration
-                    bus_data['prediction_difference_seconds'] = prediction_difference
-                    bus_data['prediction_difference_minutes'] = prediction_difference / 60
-                    bus_data['day_of_week'] = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][day_of_week]
-                    bus_data['is_weekend'] = day_of_week >= 5
-                    bus_data['time_of_day'] = get_time_of_day(hour)
-                    bus_data['peak_hours'] = is_peak_hour(hour, day_of_week)
-
-                    # Add data to database
-                    save_to_database(bus_data)
-
-                    print(f"Bus completed: Route {bus_data['route']}, Trip {trip_id}")
-                    print(f"Prediction difference for Route {bus_data['route']}, Trip {trip_id}: {round(prediction_difference/60, 2)} minutes")
-
-                    # Remove bus from tracking
-                    del tracked_buses[trip_id]
-
-            time.sleep(20)
-        except Exception as e:
-            print(f"Error: {e}")
-            time.sleep(20)
+    # Drift-corrected schedule: each cycle is 20s after the previous one
+    # was *due*, not 20s after it finished, so the poll period doesn't
+    # stretch when a cycle does real work
+    next_tick = time.monotonic()
+
+    # Exponential backoff (with jitter) for failed cycles: retry quickly
+    # after a one-off blip, ease up to a minute on a dead backend
+    backoff = 1.0
+
+    try:
+        while True:
+            try:
+                # Get current time (wall clock for the human-readable
+                # columns, monotonic for all duration arithmetic)
+                current_time = datetime.datetime.now()
+                current_mono = time.monotonic()
+
+                # Call get live data and pass the stop to get the data and assign it to 'data' for alongside the logger
+                data = get_live_data(stop_id, logger=logger, routes=routes)
+
+                # If the fetch failed, back off and retry rather than blowing
+                # up on data['live'] and losing the cycle to the except handler
+                if not data or 'live' not in data:
+                    next_tick += backoff + random.uniform(0, backoff * 0.1)
+                    backoff = min(backoff * 2, 60.0)
+                    time.sleep(max(0.0, next_tick - time.monotonic()))
+                    continue
+
+                # Cycle is healthy, reset the backoff
+                backoff = 1.0
+
+                # Start a new mark cycle; format the poll's timestamp once so
+                # every bus first seen this cycle shares the same string
+                cycle_id += 1
+                now_str = current_time.isoformat(sep=' ', timespec='seconds')
+
+                # Bind the lookups the per-bus loop repeats to locals once
+                # per cycle: LOAD_FAST instead of a global/dict lookup per
+                # bus, and .get() finds-or-misses in a single hash probe
+                # where "in" followed by [] would hash the trip_id twice
+                lookup = tracked_buses.get
+
+                # Loop through each bus in the API response and add it to our current trips
+                for bus in data['live']:
+                    # The server already filters on route= for us; this
+                    # repeat of the check just keeps the filter honest
+                    # against an older backend that ignores the parameter
+                    if routes is not None and bus['route'] not in routes:
+                        continue
+
+                    trip_id = bus['trip_id']
+                    due_seconds = bus['dueInSeconds']
+
+                    tracked = lookup(trip_id)
+
+                    # If we're already tracking this bus, update its last seen time and mark it as seen
+                    if tracked is not None:
+                        tracked.last_seen_at = current_time
+                        tracked.last_seen_mono = current_mono
+                        tracked.last_seen_due_seconds = due_seconds
+                        tracked.seen_cycle = cycle_id
+
+                    # If it's a new bus and it's due in the next 10 mins (600 secs), start tracking it
+                    elif due_seconds <= 600:
+                        tracked = TrackedBus(trip_id, bus, current_time, now_str, current_mono, cycle_id)
+                        tracked_buses[trip_id] = tracked
+                        wal.write(_wal_seen_line(tracked))
+
+                        logging.info("New bus detected: Route %s, Trip %s, Due in %.2f minutes", bus['route'], trip_id, due_seconds / 60)
+
+                # Completed buses from this poll cycle, flushed to the database in one batch
+                completed_rows = []
+
+                # Sweep: any tracked bus not marked this cycle has disappeared from the response (therefore potentially arrived).
+                # Collect just the stale entries rather than snapshotting the whole dict
+                disappeared = [(tid, bd) for tid, bd in tracked_buses.items()
+                               if bd.seen_cycle != cycle_id]
+
+                for trip_id, bus_data in disappeared:
+                    # Calculate how many seconds its been since we last saw said bus
+                    # (monotonic deltas: immune to the wall clock being stepped
+                    # mid-run, and a plain float subtraction per bus)
+                    seconds_since_last_seen = current_mono - bus_data.last_seen_mono
+
+                    # If statement to only mark bus as arrived if it hasnt been seen in over 300 secs (to prevent busses that temporarily disappeared from tracking being marked as arrived)
+                    if seconds_since_last_seen > 300:
+
+                        # Calculate derived values
+                        actual_duration = bus_data.last_seen_mono - bus_data.first_seen_mono
+                        prediction_difference = actual_duration - bus_data.initial_due_in_seconds
+
+                        # Add the finished bus to this cycle's batch (keys match the table's columns)
+                        completed_rows.append(_completed_row(bus_data, actual_duration, prediction_difference))
+
+                        # Mark it done in the WAL so a restart won't resurrect it
+                        wal.write(_dumps({'e': 'done', 'trip_id': trip_id}) + b'\n')
+
+                        logging.info("Bus completed: Route %s, Trip %s", bus_data.route, trip_id)
+                        logging.info("Prediction difference for Route %s, Trip %s: %.2f minutes", bus_data.route, trip_id, prediction_difference / 60)
+
+                        # Remove bus from tracking (pop finds and removes in one hash lookup)
+                        tracked_buses.pop(trip_id, None)
+
+                # Write every completion from this cycle in a single transaction
+                save_batch_to_database(completed_rows)
+
+                next_tick += _poll_interval(data)
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+            # Only malformed feed entries land here (missing keys, wrong
+            # types); fetch errors are handled above and anything else is
+            # a bug that should propagate instead of looping silently
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error("Error: %s", e)
+                next_tick += backoff + random.uniform(0, backoff * 0.1)
+                backoff = min(backoff * 2, 60.0)
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+    finally:
+        # Flush queued database rows and API log entries before exiting
+        # (Ctrl-C included)
+        flush_database()
+        logger.close()
+        wal.close()
+
+# Monitors several stops at once, one monitor_bus loop per thread
+def monitor_stops(stop_ids: List[str], routes: Optional[frozenset] = None):
+    """Monitor multiple stops concurrently.
+
+    Each stop runs its own monitor_bus loop on a daemon thread with its
+    own keep-alive connection and API log; database writes from the
+    threads are serialized inside database.py. routes, if given, limits
+    every stop to that frozenset of route numbers.
+    """
+    if len(stop_ids) == 1:
+        monitor_bus(stop_ids[0], routes)
+        return
+
+    threads = [threading.Thread(target=monitor_bus, args=(stop_id, routes), daemon=True)
+               for stop_id in stop_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 if __name__ == "__main__":
-    STOP_ID = "8220DB000017"  # This is Drumcondra Rail Station's stop
-    monitor_bus(STOP_ID)
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s',
+        datefmt='%Y/%m/%d %H:%M:%S',
+        level=logging.INFO)
+
+    STOP_IDS = ["8220DB000017"]  # This is Drumcondra Rail Station's stop
+
+    # Optionally restrict to specific routes, e.g. frozenset({"41", "41A"});
+    # None tracks everything at the stop
+    ROUTES = None
+    monitor_stops(STOP_IDS, ROUTES)